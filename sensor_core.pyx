@@ -0,0 +1,30 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled sensor value update for the Rideau Canal Sensor Simulator.
+Used by sensor_simulator.py when Numba is not installed.
+
+Build in place with:
+    cythonize -i sensor_core.pyx
+"""
+
+
+cpdef void update_row(short[::1] row, const short[::1] lo, const short[::1] hi,
+                      const short[::1] rand_u) noexcept:
+    """
+    Apply one tick of variation to a location's sensor values in place.
+
+    Args:
+        row: Current sensor values for one location, in tenths (SENSORS order)
+        lo: Minimum value per sensor, in tenths
+        hi: Maximum value per sensor, in tenths
+        rand_u: Random variation per sensor in tenths (already scaled for asymmetric sensors)
+    """
+    cdef Py_ssize_t j
+    cdef int new_value
+    for j in range(row.shape[0]):
+        new_value = row[j] + rand_u[j]
+        if new_value < lo[j]:
+            new_value = lo[j]
+        elif new_value > hi[j]:
+            new_value = hi[j]
+        row[j] = <short>new_value
@@ -5,17 +5,26 @@ Sends sensor data to Azure IoT Hub every 10 seconds
 """
 
 import asyncio
-import json
 import os
-import random
 import sys
 import time
 import warnings
 import logging
+import logging.handlers
 from datetime import datetime, timezone
 from typing import Dict, Optional
 
-from azure.iot.device import IoTHubDeviceClient
+import numpy as np
+from azure.iot.device import Message
+from azure.iot.device.aio import IoTHubDeviceClient
+from azure.iot.device.exceptions import (
+    ClientError,
+    ConnectionDroppedError,
+    NoConnectionError,
+    OperationCancelled,
+    OperationTimeout,
+    ServiceError,
+)
 from dotenv import load_dotenv
 
 # Suppress background thread warnings and reduce logging noise
@@ -23,12 +32,48 @@ logging.getLogger("azure.iot.device").setLevel(logging.ERROR)
 logging.getLogger("azure.iot.device.common").setLevel(logging.ERROR)
 warnings.filterwarnings("ignore", category=UserWarning)
 
-# Try to import IoTHubError, fallback to Exception if not available
+# Per-send telemetry log, buffered so each tick does not write to stdout;
+# warnings, errors (and a full buffer) flush it immediately
+_log_handler = logging.handlers.MemoryHandler(
+    capacity=16,
+    flushLevel=logging.WARNING,
+    target=logging.StreamHandler(sys.stdout),
+)
+_log_handler.target.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", datefmt="%H:%M:%S"))
+log = logging.getLogger("sensor_simulator")
+log.setLevel(logging.INFO)
+log.addHandler(_log_handler)
+log.propagate = False
+
+# Use Numba to compile the value update when available, plain Python otherwise
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Otherwise use the Cython build of the value update (sensor_core.pyx) if it has been compiled
+try:
+    from sensor_core import update_row as _update_row_cython
+    CYTHON_AVAILABLE = True
+except ImportError:
+    CYTHON_AVAILABLE = False
+
+# Use orjson for message serialization when available, stdlib json otherwise
 try:
-    from azure.iot.device.exceptions import IoTHubError
+    import orjson
+    _dumps = orjson.dumps
+    ORJSON_AVAILABLE = True
 except ImportError:
-    # For newer SDK versions, use generic Exception
-    IoTHubError = Exception
+    import json
+    ORJSON_AVAILABLE = False
+    
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, default=datetime.isoformat).encode()
+
+# Errors the SDK raises from connect/send in normal operation (dropped links,
+# hub rejections, timeouts), plus the underlying socket errors
+CLIENT_ERRORS = (ClientError, ServiceError, OperationCancelled, OperationTimeout, OSError)
 
 # Load environment variables
 load_dotenv()
@@ -58,8 +103,119 @@ SENSOR_RANGES = {
     "externalTemperature": {"min": -15, "max": 5, "variation": 2},
 }
 
-# Store current sensor values for gradual changes
-current_values: Dict[str, Dict[str, float]] = {}
+# Sensor order used by the state and variation arrays below
+SENSORS = tuple(SENSOR_RANGES)
+
+# Starting ranges for each sensor, in SENSORS order
+INITIAL_RANGES = {
+    "iceThickness": (25, 35),
+    "surfaceTemperature": (-5, -2),
+    "snowAccumulation": (0, 10),
+    "externalTemperature": (-10, -2),
+}
+
+# Number of ticks of random variations drawn per location in one RNG call
+VARIATION_BATCH_SIZE = 64
+
+# Sensor values are held as integer tenths of a unit (readings have one decimal place)
+_lo = np.array([SENSOR_RANGES[s]["min"] * 10 for s in SENSORS], dtype=np.int16)
+_hi = np.array([SENSOR_RANGES[s]["max"] * 10 for s in SENSORS], dtype=np.int16)
+_var = np.array([SENSOR_RANGES[s]["variation"] * 10 for s in SENSORS], dtype=np.int16)
+_loc_idx = {location: i for i, location in enumerate(LOCATIONS)}
+
+# Independent random generator per location (no shared RNG state between locations)
+_rngs = [np.random.default_rng(seed) for seed in np.random.SeedSequence().spawn(len(LOCATIONS))]
+
+# Scale applied to positive/negative variations; snow can increase more than decrease
+_up_coef = np.ones(len(SENSORS))
+_down_coef = np.ones(len(SENSORS))
+_up_coef[SENSORS.index("snowAccumulation")] = 1.5
+_down_coef[SENSORS.index("snowAccumulation")] = 0.5
+
+# Pre-drawn variations, consumed one row per tick per location
+_batch = np.empty((VARIATION_BATCH_SIZE, len(LOCATIONS), len(SENSORS)), dtype=np.int16)
+_batch_idx = [VARIATION_BATCH_SIZE] * len(LOCATIONS)
+
+# Current sensor values (in tenths) for gradual changes, one row per location (SENSORS order)
+_state = np.array([
+    rng.integers([INITIAL_RANGES[s][0] * 10 for s in SENSORS],
+                 [INITIAL_RANGES[s][1] * 10 for s in SENSORS], endpoint=True)
+    for rng in _rngs
+], dtype=np.int16)
+
+# Per-location message payloads; only the timestamp and readings change per tick
+_templates = {
+    location: {
+        "deviceId": location,
+        "location": config["name"],
+        "timestamp": None,
+        **{sensor: 0.0 for sensor in SENSORS},
+    }
+    for location, config in LOCATIONS.items()
+}
+
+
+def _next_variation(location: str) -> np.ndarray:
+    """Return the next pre-drawn variation row for a location, refilling as needed."""
+    i = _loc_idx[location]
+    if _batch_idx[i] == VARIATION_BATCH_SIZE:
+        # Draw and scale continuously, then round once to whole tenths
+        batch = _rngs[i].uniform(-_var, _var, (VARIATION_BATCH_SIZE, len(SENSORS)))
+        batch *= np.where(batch > 0, _up_coef, _down_coef)
+        _batch[:, i] = np.rint(batch)
+        _batch_idx[i] = 0
+    row = _batch[_batch_idx[i], i]
+    _batch_idx[i] += 1
+    return row
+
+
+def _update_row_numpy(row, lo, hi, rand_u):
+    """
+    Apply one tick of variation to a location's sensor values in place.
+    
+    Args:
+        row: Current sensor values for one location, in tenths (SENSORS order)
+        lo: Minimum value per sensor, in tenths
+        hi: Maximum value per sensor, in tenths
+        rand_u: Random variation per sensor in tenths (already scaled for asymmetric sensors)
+    """
+    row += rand_u
+    np.clip(row, lo, hi, out=row)
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _update_row(row, lo, hi, rand_u):
+        """Numba-compiled equivalent of _update_row_numpy."""
+        for j in range(row.shape[0]):
+            row[j] = min(hi[j], max(lo[j], row[j] + rand_u[j]))
+elif CYTHON_AVAILABLE:
+    _update_row = _update_row_cython
+else:
+    _update_row = _update_row_numpy
+
+
+# Last second for which the ISO timestamp was formatted, and its string
+_last_sec = -1
+_last_iso = ""
+
+
+def _utc_now_iso() -> str:
+    """Return the current UTC time as an ISO 8601 string, reformatted at most once per second."""
+    global _last_sec, _last_iso
+    sec = int(time.time())
+    if sec != _last_sec:
+        _last_sec = sec
+        _last_iso = datetime.fromtimestamp(sec, timezone.utc).isoformat()
+    return _last_iso
+
+
+def _utc_now() -> datetime:
+    """Return the current UTC time as a datetime (serialized natively by orjson)."""
+    return datetime.now(timezone.utc)
+
+
+_timestamp = _utc_now if ORJSON_AVAILABLE else _utc_now_iso
 
 
 def generate_sensor_data(location: str) -> Dict:
@@ -71,59 +227,46 @@ def generate_sensor_data(location: str) -> Dict:
         location: Location identifier (dows-lake, fifth-avenue, nac)
     
     Returns:
-        Dictionary containing sensor readings
+        Dictionary containing sensor readings (the same dict is reused for
+        the location on every call)
     """
-    # Initialize current values if not exists
-    if location not in current_values:
-        current_values[location] = {
-            "iceThickness": random.uniform(25, 35),
-            "surfaceTemperature": random.uniform(-5, -2),
-            "snowAccumulation": random.uniform(0, 10),
-            "externalTemperature": random.uniform(-10, -2),
-        }
+    # Get current values (a view into the shared state array)
+    values = _state[_loc_idx[location]]
     
-    # Get current values
-    values = current_values[location]
-    
-    # Generate new values with gradual changes
-    for sensor, range_config in SENSOR_RANGES.items():
-        current = values[sensor]
-        min_val = range_config["min"]
-        max_val = range_config["max"]
-        variation = range_config["variation"]
-        
-        # Add random variation within allowed range
-        change = random.uniform(-variation, variation)
-        new_value = current + change
-        
-        # Clamp to valid range
-        new_value = max(min_val, min(max_val, new_value))
-        
-        # Special handling for snow accumulation (can only increase or decrease slightly)
-        if sensor == "snowAccumulation":
-            # Snow can increase more than decrease
-            if change > 0:
-                new_value = min(max_val, current + random.uniform(0, variation * 1.5))
-            else:
-                new_value = max(min_val, current - random.uniform(0, variation * 0.5))
-        
-        values[sensor] = round(new_value, 1)
+    # Add random variation, clamp to valid range and keep one decimal place
+    _update_row(values, _lo, _hi, _next_variation(location))
+    readings = (values / 10).tolist()
     
-    # Create message payload
-    message = {
-        "deviceId": location,
-        "location": LOCATIONS[location]["name"],
-        "timestamp": datetime.now(timezone.utc).isoformat(),
-        "iceThickness": values["iceThickness"],
-        "surfaceTemperature": values["surfaceTemperature"],
-        "snowAccumulation": values["snowAccumulation"],
-        "externalTemperature": values["externalTemperature"],
-    }
+    # Update the location's message payload in place
+    message = _templates[location]
+    message["timestamp"] = _timestamp()
+    message.update(zip(SENSORS, readings))
     
     return message
 
 
-def create_client(connection_string: str) -> Optional[IoTHubDeviceClient]:
+# One Message per location, reused while sends complete normally (only its data changes)
+_messages: Dict[str, Message] = {location: Message(b"") for location in LOCATIONS}
+
+# Cached connection state per client, kept current by the SDK's state callback
+_connected: Dict[IoTHubDeviceClient, bool] = {}
+
+
+def _track_connection(client: IoTHubDeviceClient):
+    """
+    Register a connection state handler that caches the client's state.
+    
+    Args:
+        client: IoT Hub device client
+    """
+    def on_connection_state_change():
+        _connected[client] = client.connected
+    
+    client.on_connection_state_change = on_connection_state_change
+    _connected[client] = client.connected
+
+
+async def create_client(connection_string: str) -> Optional[IoTHubDeviceClient]:
     """
     Create and connect an IoT Hub device client.
     
@@ -139,101 +282,157 @@ def create_client(connection_string: str) -> Optional[IoTHubDeviceClient]:
     
     try:
         client = IoTHubDeviceClient.create_from_connection_string(connection_string)
-        client.connect()
-        return client
-    except Exception as e:
+    except ValueError as e:
+        # Malformed connection string
+        print(f"Error creating client: {str(e)}")
+        return None
+    
+    _track_connection(client)
+    try:
+        await client.connect()
+    except CLIENT_ERRORS as e:
         print(f"Error creating client: {str(e)}")
+        
+        # Stop tracking and release the client that failed to connect
+        _connected.pop(client, None)
+        try:
+            await client.shutdown()
+        except CLIENT_ERRORS:
+            pass
         return None
+    
+    _connected[client] = client.connected
+    return client
 
 
-async def send_telemetry(client: IoTHubDeviceClient, location: str, data: Dict, connection_string: str):
+async def _do_send(client: IoTHubDeviceClient, location: str, name: str, data: Dict):
     """
-    Send telemetry data to IoT Hub with reconnection logic.
+    Serialize and send one telemetry message, then log the readings.
     
     Args:
         client: IoT Hub device client
         location: Location identifier
+        name: Display name of the location
         data: Sensor data dictionary
-        connection_string: Connection string for reconnection if needed
     """
+    message = _messages[location]
+    message.data = _dumps(data)
     try:
-        # Check if client is connected, reconnect if not
+        await client.send_message(message)
+    except BaseException:
+        # The SDK may still hold this message (e.g. the send was cancelled or
+        # timed out), so the next send gets a fresh one instead of rewriting it
+        _messages[location] = Message(b"")
+        raise
+    log.info("%s: Ice=%scm, Surface=%s°C, Snow=%scm, External=%s°C",
+             name, data["iceThickness"], data["surfaceTemperature"],
+             data["snowAccumulation"], data["externalTemperature"])
+
+
+async def send_telemetry(client: IoTHubDeviceClient, location: str, name: str, data: Dict):
+    """
+    Send telemetry data to IoT Hub with reconnection logic.
+    
+    Args:
+        client: IoT Hub device client
+        location: Location identifier
+        name: Display name of the location
+        data: Sensor data dictionary
+    """
+    # Reconnect only if the state callback reported a dropped connection
+    if not _connected.get(client, False):
+        log.info("Reconnecting %s...", name)
         try:
-            if not client.connected:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] Reconnecting {LOCATIONS[location]['name']}...")
-                client.connect()
-        except:
-            # If connection check fails, try to reconnect
-            try:
-                client.disconnect()
-            except:
-                pass
-            try:
-                client.connect()
-            except Exception as e:
-                print(f"Warning: Could not reconnect {location}: {str(e)}")
-                return
-        
+            await client.connect()
+        except CLIENT_ERRORS as e:
+            log.warning("Could not reconnect %s: %s", name, e)
+            return
+        _connected[client] = client.connected
+    
+    try:
         # Send the message
-        message_json = json.dumps(data)
-        client.send_message(message_json)
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] {LOCATIONS[location]['name']}: "
-              f"Ice={data['iceThickness']}cm, "
-              f"Surface={data['surfaceTemperature']}°C, "
-              f"Snow={data['snowAccumulation']}cm, "
-              f"External={data['externalTemperature']}°C")
-    except IoTHubError as e:
-        # Try to reconnect and send again
+        await _do_send(client, location, name, data)
+    except NoConnectionError:
+        # Connection went away after the state check; reconnect and send again
         try:
-            if "not connected" in str(e).lower():
-                client.connect()
-                message_json = json.dumps(data)
-                client.send_message(message_json)
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] {LOCATIONS[location]['name']}: "
-                      f"Ice={data['iceThickness']}cm, "
-                      f"Surface={data['surfaceTemperature']}°C, "
-                      f"Snow={data['snowAccumulation']}cm, "
-                      f"External={data['externalTemperature']}°C")
-            else:
-                print(f"Error sending message from {location}: {str(e)}")
-        except:
-            print(f"Error sending message from {location}: {str(e)}")
-    except Exception as e:
-        # Suppress connection drop errors from background threads
-        if "ConnectionDroppedError" not in str(type(e).__name__):
-            print(f"Unexpected error sending message from {location}: {str(e)}")
-
-
-async def run_sensor(location: str, client: IoTHubDeviceClient):
+            await client.connect()
+            await _do_send(client, location, name, data)
+        except CLIENT_ERRORS as retry_err:
+            log.error("Error sending message from %s: %s", name, retry_err)
+    except ConnectionDroppedError:
+        # The state callback marks the client disconnected, so the next tick
+        # reconnects; this tick's reading is not sent
+        log.warning("Dropped reading from %s: connection lost", name)
+    except CLIENT_ERRORS as e:
+        log.error("Error sending message from %s: %s", name, e)
+
+
+async def run_sensor(location: str, name: str, client: IoTHubDeviceClient, start: float):
     """
     Run sensor simulation loop for a location.
     
+    Ticks follow absolute deadlines counted from a start time shared by all
+    locations, so the locations stay in phase while a slow or stalled device
+    only delays its own sends.
+    
     Args:
         location: Location identifier
+        name: Display name of the location
         client: IoT Hub device client
+        start: Event loop time of the first tick
     """
-    print(f"Starting sensor simulation for {LOCATIONS[location]['name']}...")
-    connection_string = LOCATIONS[location]["connection_string"]
+    loop = asyncio.get_running_loop()
+    next_tick = start
     
     while True:
         try:
-            # Generate sensor data
-            data = generate_sensor_data(location)
-            
-            # Send to IoT Hub (with reconnection logic)
-            await send_telemetry(client, location, data, connection_string)
-            
-            # Wait for next interval
-            await asyncio.sleep(SEND_INTERVAL)
+            # Generate sensor data and send to IoT Hub (with reconnection logic);
+            # a send still pending at the next tick is abandoned
+            await asyncio.wait_for(
+                send_telemetry(client, location, name, generate_sensor_data(location)),
+                SEND_INTERVAL,
+            )
             
         except KeyboardInterrupt:
-            print(f"\nStopping sensor for {LOCATIONS[location]['name']}...")
+            print(f"\nStopping sensor for {name}...")
             break
+        except asyncio.TimeoutError:
+            log.warning("Dropped reading from %s: send timed out", name)
         except Exception as e:
-            # Suppress background thread connection drop errors
-            if "ConnectionDroppedError" not in str(type(e).__name__):
-                print(f"Error in sensor loop for {location}: {str(e)}")
-            await asyncio.sleep(SEND_INTERVAL)
+            # Keep the simulator running through unexpected errors
+            log.error("Error in sensor loop for %s: %s: %s", name, type(e).__name__, e)
+        
+        # Wait for next interval, skipping any ticks already missed
+        next_tick += SEND_INTERVAL
+        now = loop.time()
+        if next_tick < now:
+            next_tick += ((now - next_tick) // SEND_INTERVAL + 1) * SEND_INTERVAL
+        await asyncio.sleep(next_tick - now)
+
+
+async def run_sensors(clients: Dict[str, IoTHubDeviceClient]):
+    """
+    Run the sensor simulation loops for all connected locations.
+    
+    Each location runs in its own task on a shared tick schedule.
+    
+    Args:
+        clients: IoT Hub device client per location identifier
+    """
+    # Static per-location details, looked up once rather than on every tick
+    devices = [
+        (location, LOCATIONS[location]["name"], client)
+        for location, client in clients.items()
+    ]
+    for _, name, _ in devices:
+        print(f"Starting sensor simulation for {name}...")
+    
+    # Ticks are scheduled against absolute deadlines so send time does not accumulate as drift
+    start = asyncio.get_running_loop().time()
+    await asyncio.gather(*[
+        run_sensor(location, name, client, start)
+        for location, name, client in devices
+    ])
 
 
 async def main():
@@ -263,11 +462,13 @@ async def main():
     else:
         selected_locations = list(LOCATIONS.keys())
     
-    # Create clients for selected locations
+    # Create clients for selected locations (connecting concurrently)
+    created = await asyncio.gather(*[
+        create_client(LOCATIONS[location]["connection_string"])
+        for location in selected_locations
+    ])
     clients = {}
-    for location in selected_locations:
-        connection_string = LOCATIONS[location]["connection_string"]
-        client = create_client(connection_string)
+    for location, client in zip(selected_locations, created):
         if client:
             clients[location] = client
         else:
@@ -283,20 +484,20 @@ async def main():
     
     # Run all sensors concurrently
     try:
-        tasks = [
-            run_sensor(location, client)
-            for location, client in clients.items()
-        ]
-        await asyncio.gather(*tasks)
+        await run_sensors(clients)
     except KeyboardInterrupt:
         print("\n\nStopping all sensors...")
     finally:
-        # Disconnect all clients
+        # Write out any buffered telemetry log lines first
+        _log_handler.flush()
+        
+        # Disconnect all clients and release their handler resources
         for location, client in clients.items():
+            _connected.pop(client, None)
             try:
-                client.disconnect()
+                await client.shutdown()
                 print(f"Disconnected {LOCATIONS[location]['name']}")
-            except:
+            except CLIENT_ERRORS:
                 pass
         print("Simulator stopped.")
 